@@ -4,21 +4,54 @@ Static Library Merger - Merges multiple static libraries into a single archive.
 """
 
 import argparse
+import errno
+import hashlib
 import logging
+import os
 import platform
+import queue
+import re
+import shutil
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# Characters GNU ar's MRI script parser accepts in a file name. It has no
+# quoting, so paths with spaces, parentheses, commas etc. cannot be expressed.
+MRI_SAFE_PATH = re.compile(r'[A-Za-z0-9/\\$:.\-_+~]+')
+
+try:
+    import libarchive
+except (ImportError, OSError, AttributeError):
+    # libarchive-c fails at import time with OSError/AttributeError when the
+    # native libarchive shared library is missing
+    libarchive = None
+
 class StaticLibraryMerger:
-    def __init__(self, output_lib, llvm_install_dir):
+    def __init__(self, output_lib, llvm_install_dir, extract_objects=False,
+                 tmp_base=None, dedupe_objects=False):
         self.output_lib = Path(output_lib).resolve()
         self.llvm_install_dir = Path(llvm_install_dir).resolve()
         if not self.llvm_install_dir.is_dir():
             raise FileNotFoundError(f"Invalid LLVM installation directory: {llvm_install_dir}")
 
+        # Deduplication needs the extracted objects, so it implies extraction
+        self.extract_objects = extract_objects or dedupe_objects
+        self.dedupe_objects = dedupe_objects
+        self.tmp_base = tmp_base
         self.tmpdir = None
+        self.build_lib = None
+        self._failed = threading.Event()
+        self._objects = None
+        self._seen_digests = None
+        self._ar_output_dir_supported = None
+        self._ar_mri_supported = None
+        self._mri_merge_usable = None
+        self._win_paths = {}
         self.logger = logging.getLogger(self.__class__.__name__)
         
         # Platform configuration
@@ -26,7 +59,19 @@ class StaticLibraryMerger:
         if self.system.startswith('MSYS'):
             self.system = 'Windows'
 
-        logging.info(f"Detected system: {self.system}")
+        logging.info("Detected system: %s", self.system)
+
+        if self.system == 'Windows':
+            # Convert the well-known MSYS2 paths with a single cygpath call
+            self._to_win_paths([
+                '/mingw64/bin/ar.exe',
+                '/mingw64/bin/ranlib.exe',
+                '/mingw64/lib/libstdc++.a',
+            ])
+
+        # Resolve the archiver binaries once up front
+        self.ar_bin = self._find_tool('ar')
+        self.ranlib_bin = self._find_ranlib()
 
         self.obj_ext = self._get_obj_ext()
         self.ar_cmd = self._get_ar_command()
@@ -35,78 +80,290 @@ class StaticLibraryMerger:
         """Get platform-specific object file extension"""
         return '.obj' if self.system == 'Windows' else '.o'
     
-    def _get_ar(self):
-        """Get platform-specific ar command"""
+    def _find_tool(self, name):
+        """Get platform-specific path of a binutils tool"""
         if self.system == "Windows":
-            return self._to_win_path("/mingw64/bin/ar.exe")
+            return self._to_win_path(f"/mingw64/bin/{name}.exe")
+
+        return shutil.which(name) or name
+
+    def _find_ranlib(self):
+        """Prefer llvm-ranlib from the LLVM installation over binutils ranlib"""
+        exe_suffix = '.exe' if self.system == 'Windows' else ''
+        llvm_ranlib = self.llvm_install_dir / 'bin' / f'llvm-ranlib{exe_suffix}'
+        if llvm_ranlib.is_file():
+            return str(llvm_ranlib)
 
-        return 'ar'
+        return self._find_tool('ranlib')
 
     def _get_ar_command(self):
         """Get platform-specific ar command parameters"""
         if self.system == 'Darwin':
-            return [self._get_ar(), '-qcT']
+            return [self.ar_bin, '-qcT']
+        # Quick-append without a symbol table; ranlib indexes the result once
         if self.system == 'Windows':
-            return [self._get_ar(), '-rcs']
+            return [self.ar_bin, '-qc']
         if self.system == 'Linux':
-            return [self._get_ar(), '-rcs']
+            return [self.ar_bin, '-qc']
         raise RuntimeError(f"Unsupported system: {self.system}")
 
     def _to_win_path(self, path):
         """Convert path to Windows-style using cygpath -w (Windows only)"""
         if self.system != 'Windows':
             return str(path)
+        path = str(path)
+        return self._to_win_paths([path])[path]
+
+    def _to_win_paths(self, paths):
+        """Convert paths to Windows-style with at most one cygpath call"""
+        missing = [path for path in dict.fromkeys(paths) if path not in self._win_paths]
+        if missing:
+            self._win_paths.update(self._cygpath_w_batch(missing))
+        return {path: self._win_paths[path] for path in paths}
+
+    def _cygpath_w_batch(self, paths):
+        """Convert several paths with one cygpath -w call, keyed by input"""
         try:
             result = subprocess.run(
-                ['cygpath', '-w', str(path)],
+                ['cygpath', '-w', '--', *paths],
                 check=True,
                 capture_output=True,
                 text=True
             )
-            return result.stdout.strip()
+            return dict(zip(paths, result.stdout.splitlines()))
         except subprocess.CalledProcessError as e:
-            self.logger.error(f"Windows path conversion failed: {e.stderr.strip()}")
+            self.logger.error("Windows path conversion failed: %s", e.stderr.strip())
             raise
 
-    def _run_command(self, cmd, cwd=None):
+    def _run_command(self, cmd, cwd=None, stdin=None):
         """Execute command with proper path conversions"""
         # Keep cwd as native path
         cmd = [str(arg) for arg in cmd]
+        if self.system == 'Windows':
+            # Convert every POSIX-style argument in one cygpath round-trip
+            win_paths = self._to_win_paths([arg for arg in cmd if arg.startswith('/')])
+            cmd = [win_paths.get(arg, arg) for arg in cmd]
 
-        self.logger.info(f"Executing: {' '.join(cmd)}")
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("Executing: %s", self._format_cmd(cmd))
         if cwd:
-            self.logger.info(f"Working directory: {cwd}")
+            self.logger.info("Working directory: %s", cwd)
         try:
-            subprocess.run(
-                cmd,
-                cwd=str(cwd) if cwd else None,
-                check=True
-            )
+            if cwd is None and stdin is None and hasattr(os, 'posix_spawnp'):
+                self._spawn_wait(cmd)
+            else:
+                subprocess.run(
+                    cmd,
+                    cwd=str(cwd) if cwd else None,
+                    stdin=stdin,
+                    check=True
+                )
         except subprocess.CalledProcessError as e:
-            self.logger.error(f"Command failed: {e}")
+            self.logger.error("Command failed: %s", e)
             raise
 
+    def _format_cmd(self, cmd, max_args=16):
+        """Render a command for logging, eliding long argument lists unless debugging"""
+        if len(cmd) > max_args and not self.logger.isEnabledFor(logging.DEBUG):
+            cmd = cmd[:max_args] + [f"... ({len(cmd) - max_args} more arguments)"]
+        return ' '.join(cmd)
+
+    @staticmethod
+    def _spawn_wait(cmd):
+        """Run a command via posix_spawn and wait, raising on failure"""
+        # Reset the signals Python ignores, as subprocess does by default
+        setsigdef = [
+            getattr(signal, name) for name in ('SIGPIPE', 'SIGXFZ', 'SIGXFSZ')
+            if hasattr(signal, name)
+        ]
+        pid = os.posix_spawnp(cmd[0], cmd, os.environ, setsigdef=setsigdef)
+        _, status = os.waitpid(pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
     def _get_stem(self, path):
         """Get stem of the path"""
-        if self.system != 'Windows':
-            return path.stem
-        return str(path).replace('\\', '/').split('/')[-1].split('.')[0]
+        # Native Windows paths use backslashes, which os.path does not split on under MSYS
+        name = os.path.basename(os.fspath(path).replace('\\', '/'))
+        return os.path.splitext(name)[0]
+
+    def _ar_supports_output_dir(self):
+        """Check whether ar accepts --output for extraction (binutils 2.34+)"""
+        if self._ar_output_dir_supported is None:
+            try:
+                result = subprocess.run(
+                    [self.ar_bin, '--help'],
+                    capture_output=True,
+                    text=True
+                )
+                self._ar_output_dir_supported = '--output' in result.stdout + result.stderr
+            except OSError:
+                self._ar_output_dir_supported = False
+        return self._ar_output_dir_supported
+
+    def _list_members(self, lib_path):
+        """List member names of a static library with ar t"""
+        try:
+            result = subprocess.run(
+                [self.ar_bin, 't', str(lib_path)],
+                check=True,
+                capture_output=True,
+                text=True
+            )
+            return [os.path.basename(name) for name in result.stdout.splitlines()]
+        except subprocess.CalledProcessError as e:
+            self.logger.error("Listing %s failed: %s", lib_path, e.stderr.strip())
+            raise
+
+    def _supports_mri_script(self):
+        """Check whether ar accepts MRI scripts on stdin (GNU and LLVM ar)"""
+        if self._ar_mri_supported is None:
+            try:
+                result = subprocess.run(
+                    [self.ar_bin, '-M'],
+                    input='END\n',
+                    capture_output=True,
+                    text=True
+                )
+                self._ar_mri_supported = result.returncode == 0
+            except OSError:
+                self._ar_mri_supported = False
+        return self._ar_mri_supported
+
+    def _extract_archive(self, lib_path, output_dir):
+        """Extract a static library into output_dir, mapping object paths to digests
+
+        Digests are only computed when deduplicating; otherwise they are None.
+        """
+        output_dir = os.fspath(output_dir)
+
+        # Members sharing a name overwrite each other on extraction, so the
+        # digest of the last one is kept
+        digests = {}
+        if libarchive is None:
+            names = self._list_members(lib_path)
+            if self._ar_supports_output_dir():
+                output = f"--output={self._to_win_path(output_dir)}"
+                self._run_command([self.ar_bin, output, 'x', lib_path])
+            else:
+                self._run_command([self.ar_bin, 'x', lib_path], cwd=output_dir)
+            for name in dict.fromkeys(names):
+                if name.endswith(self.obj_ext):
+                    path = os.path.join(output_dir, name)
+                    digests[path] = None
+                    if self.dedupe_objects:
+                        with open(path, 'rb') as f:
+                            digests[path] = hashlib.sha1(f.read()).digest()
+        else:
+            # Read the members in-process instead of spawning ar for each archive
+            with libarchive.file_reader(str(lib_path)) as archive:
+                for entry in archive:
+                    name = os.path.basename(entry.pathname)
+                    # Skip the archive symbol table
+                    if not name or name.startswith('__.SYMDEF'):
+                        continue
+                    blocks = list(entry.get_blocks())
+                    path = os.path.join(output_dir, name)
+                    self._write_blocks(path, blocks)
+                    if not name.endswith(self.obj_ext):
+                        continue
+                    digests[path] = None
+                    if self.dedupe_objects:
+                        digest = hashlib.sha1()
+                        for block in blocks:
+                            digest.update(block)
+                        digests[path] = digest.digest()
+
+        return digests
+
+    @staticmethod
+    def _write_blocks(path, blocks):
+        """Write data blocks to path, gathering them into few writev calls"""
+        if not hasattr(os, 'writev'):
+            with open(path, 'wb') as f:
+                for block in blocks:
+                    f.write(block)
+            return
+
+        views = [memoryview(block) for block in blocks]
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            while views:
+                # Stay within the IOV_MAX limit of 1024 buffers per call
+                written = os.writev(fd, views[:1024])
+                # Drop fully written buffers and trim a partially written one
+                done = 0
+                while done < len(views) and written >= len(views[done]):
+                    written -= len(views[done])
+                    done += 1
+                del views[:done]
+                if written:
+                    views[0] = views[0][written:]
+        finally:
+            os.close(fd)
+
+    def _extract_one(self, lib_path):
+        """Extract a single static library into its own directory"""
+        # Archiving or another extraction already failed; skip the remaining
+        # libraries instead of extracting them before the error surfaces
+        if self._failed.is_set():
+            return {}
+
+        lib_name = self._get_stem(lib_path)
+        output_dir = self.tmpdir / lib_name
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        self.logger.info("Extracting %s to %s", lib_path, output_dir)
+
+        try:
+            return self._extract_archive(lib_path, output_dir)
+        except BaseException:
+            self._failed.set()
+            raise
+
+    def _queue_objects(self, digests):
+        """Queue extracted objects for merging, dropping duplicates if requested"""
+        if self.dedupe_objects:
+            self._objects.put(self._dedupe_objects(digests))
+        else:
+            self._objects.put(list(digests))
+
+    def _dedupe_objects(self, digests):
+        """Drop objects whose contents were already queued for merging"""
+        unique = []
+        for path, digest in digests.items():
+            if digest in self._seen_digests:
+                self.logger.debug("Skipping duplicate object %s", path)
+                continue
+            self._seen_digests.add(digest)
+            unique.append(path)
+        return unique
+
+    def _collect_llvm_libs(self):
+        """List LLVM static libraries, skipping DLL import libraries"""
+        # Sort so the member order of the merged library is reproducible
+        libs = [
+            lib_path for lib_path in self.llvm_install_dir.glob('lib/*.a')
+            if not lib_path.name.endswith('.dll.a')
+        ]
+        libs.sort()
+        return libs
 
     def extract_llvm_objects(self):
         """Extract object files from LLVM static libraries"""
         self.logger.info("Extracting LLVM objects...")
-        
-        for lib_path in self.llvm_install_dir.glob('lib/*.a'):
-            if lib_path.name.endswith('.dll.a'):
-                continue
-            
-            lib_name = self._get_stem(lib_path)
-            output_dir = self.tmpdir / lib_name
-            output_dir.mkdir(parents=True, exist_ok=True)
-            
-            self.logger.info(f"Extracting {lib_path} to {output_dir}")
 
-            self._run_command([self._get_ar(), 'x', lib_path], cwd=output_dir)
+        libs = self._collect_llvm_libs()
+
+        # Each archive is extracted into a distinct directory, so the ar
+        # processes can run concurrently without stepping on each other.
+        max_workers = min(32, (os.cpu_count() or 1) * 2)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for objects in executor.map(self._extract_one, libs):
+                if self._failed.is_set():
+                    break
+                self._queue_objects(objects)
 
     def _find_std_library(self):
         """Find platform-specific standard library"""
@@ -132,7 +389,7 @@ class StaticLibraryMerger:
 
         for lib_path in search_paths:
             if lib_path.exists():
-                self.logger.info(f"Found libstdc++.a at {lib_path}")
+                self.logger.info("Found libstdc++.a at %s", lib_path)
                 return lib_path
 
         raise FileNotFoundError(
@@ -140,87 +397,376 @@ class StaticLibraryMerger:
             "Try installing it with: pacman -S mingw-w64-x86_64-gcc"
         )
 
-    def extract_std_objects(self):
-        """Extract standard library objects"""
+    def _get_std_library(self):
+        """Find the standard library to bundle, or None if unavailable"""
         if self.system == 'Darwin':
-            return
+            return None
 
         try:
-            std_lib = self._find_std_library()
+            return self._find_std_library()
         except Exception as e:
-            self.logger.warning(str(e))
+            self.logger.warning("%s", e)
+            return None
+
+    def extract_std_objects(self):
+        """Extract standard library objects"""
+        std_lib = self._get_std_library()
+        if std_lib is None:
             return
 
-        self.logger.info(f"Extracting standard library: {std_lib}")
+        self.logger.info("Extracting standard library: %s", std_lib)
         lib_name = self._get_stem(std_lib)
         output_dir = self.tmpdir / lib_name
         output_dir.mkdir(parents=True, exist_ok=True)
-        
-        self._run_command([self._get_ar(), 'x', std_lib], cwd=output_dir)
 
-    def merge_objects(self):
-        """Merge all object files into final library"""
-        self.logger.info("Merging objects into final library...")
-        
-        # Ensure output directory exists
+        self._queue_objects(self._extract_archive(std_lib, output_dir))
+
+    def _prepare_output(self):
+        """Create the output directory and remove any stale library"""
         self.output_lib.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Remove existing library
+
         if self.output_lib.exists():
             self.output_lib.unlink()
 
-        # Collect all object files
-        obj_files = list(self.tmpdir.rglob(f'*{self.obj_ext}'))
-        if not obj_files:
-            self.logger.error("No object files found for merging")
-            raise RuntimeError("No objects to merge")
-            
-        self.logger.info(f"Merging {len(obj_files)} object files")
+        # The library is built in tmpdir and only moved onto output_lib once
+        # it is complete, so a failed run never leaves a partial archive
+        self.build_lib = self.tmpdir / f"build-{self.output_lib.name}"
 
-        # Handle different merging strategies
-        if self.system == 'Darwin':
-            self._merge_direct(obj_files)
-        else:
-            self._merge_with_filelist(obj_files)
+    def _publish_output(self):
+        """Move the finished library onto the output path"""
+        try:
+            os.replace(self.build_lib, self.output_lib)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # tmpdir is on another filesystem (e.g. /dev/shm); copy next to
+            # the output first so the final rename is still atomic
+            partial = self.output_lib.with_name(f".{self.output_lib.name}.tmp")
+            try:
+                shutil.copyfile(self.build_lib, partial)
+                os.replace(partial, self.output_lib)
+            except BaseException:
+                partial.unlink(missing_ok=True)
+                raise
+
+    def _is_mri_safe(self, *paths):
+        """Check whether every path can be written into an ar MRI script"""
+        return all(MRI_SAFE_PATH.fullmatch(str(path)) for path in paths)
+
+    def _use_mri_script(self):
+        """Whether archives can be merged directly with an ar MRI script"""
+        if self._mri_merge_usable is None:
+            self._mri_merge_usable = self._check_mri_merge()
+        return self._mri_merge_usable
+
+    def _check_mri_merge(self):
+        """Decide once whether the MRI ADDLIB merge can be used"""
+        if self.extract_objects or self.system not in ('Linux', 'Windows'):
+            return False
+        if not self._supports_mri_script():
+            return False
+
+        # MRI scripts cannot quote file names, so fall back to extracting
+        # objects when the output, the temporary directory the library is
+        # built in, or any input library has e.g. a space
+        tmp_base = self.tmp_base or tempfile.gettempdir()
+        paths = [self.output_lib, tmp_base, *self._collect_llvm_libs()]
+        try:
+            paths.append(self._find_std_library())
+        except Exception:
+            pass
+        if not self._is_mri_safe(*paths):
+            self.logger.info("Paths cannot be expressed in an ar MRI script, extracting objects instead")
+            return False
+        return True
+
+    def merge_archives(self):
+        """Merge static libraries into final library without extracting them
+
+        Members are copied as-is, so identical objects that appear in several
+        libraries are not deduplicated; that requires --dedupe-objects.
+        """
+        self.logger.info("Merging archives into final library...")
+
+        self._prepare_output()
+
+        libs = self._collect_llvm_libs()
+        std_lib = self._get_std_library()
+        if std_lib is not None:
+            libs.insert(0, std_lib)
+        if not libs:
+            self.logger.error("No static libraries found for merging")
+            raise RuntimeError("No libraries to merge")
+
+        self.logger.info("Merging %d static libraries", len(libs))
+
+        self._merge_mri_script(libs)
+
+        # Run ranlib after archive creation
+        self._run_ranlib()
+        self._publish_output()
+
+    def _merge_mri_script(self, libs):
+        """Let ar copy archive members via ADDLIB instead of extracting them"""
+        paths = [str(self.build_lib), *(str(lib) for lib in libs)]
+        if self.system == 'Windows':
+            win_paths = self._to_win_paths(paths)
+            paths = [win_paths[path] for path in paths]
+
+        # ar inserts every member ADDLIB copies at the head of the archive,
+        # so list the libraries last-first to keep them in order; members
+        # within each library come out reversed
+        lines = [f"CREATE {paths[0]}"]
+        lines += [f"ADDLIB {path}" for path in reversed(paths[1:])]
+        lines += ["SAVE", "END"]
+
+        script = self.tmpdir / 'merge.mri'
+        script.write_text('\n'.join(lines) + '\n')
+
+        with open(script) as f:
+            self._run_command([self.ar_bin, '-M'], stdin=f)
+
+    def merge_objects(self):
+        """Extract object files and merge them into final library"""
+        self.logger.info("Merging objects into final library...")
+
+        self._prepare_output()
+
+        # Extraction produces lists of object paths that a consumer archives
+        # in batches while the remaining libraries are still being extracted
+        self._objects = queue.Queue()
+        self._seen_digests = set()
+        self._failed.clear()
+        with ThreadPoolExecutor(max_workers=1) as consumer:
+            merged = consumer.submit(self._consume_objects)
+            try:
+                self.extract_std_objects()
+                self.extract_llvm_objects()
+            except BaseException:
+                # Tell the consumer not to combine a partial set of objects
+                self._failed.set()
+                raise
+            finally:
+                self._objects.put(None)
+            # Raises the consumer's error if archiving stopped extraction early
+            num_objects = merged.result()
+
+        self.logger.info("Merged %d object files", num_objects)
 
         # Run ranlib after archive creation
         self._run_ranlib()
+        self._publish_output()
+
+    def _consume_objects(self, batch_size=4096):
+        """Archive queued object paths in batches until extraction finishes"""
+        try:
+            return self._archive_queued_objects(batch_size)
+        except BaseException:
+            # Let the extraction threads stop early
+            self._failed.set()
+            raise
 
-    def _merge_direct(self, obj_files):
+    def _archive_queued_objects(self, batch_size):
+        """Drain the object queue into the build library, returning the count"""
+        # Partial archives need an MRI script to be combined; without one,
+        # batches are appended to the final library in order. MRI scripts
+        # cannot quote file names, so parts are only used when the temporary
+        # directory and output paths need no quoting.
+        use_parts = (
+            self.system != 'Darwin'
+            and self._supports_mri_script()
+            and self._is_mri_safe(self.tmpdir)
+        )
+
+        # ar seeks in @file lists, so they cannot be read from a pipe. Stream
+        # an MRI script to ar's stdin instead, except on Windows where the
+        # script would need every object path converted with cygpath, and
+        # for batches with object paths the script cannot express.
+        def archive_objects(archive, objects):
+            if self.system == 'Darwin':
+                self._merge_direct(archive, objects)
+            elif not use_parts:
+                self._archive_filelist(archive, objects)
+            elif self.system == 'Windows' or not self._is_mri_safe(*objects):
+                # Match the reversed member order of _archive_mri_stream
+                self._archive_filelist(archive, objects[::-1])
+            else:
+                self._archive_mri_stream(archive, objects)
+
+        num_objects = 0
+        parts = []
+        pending = []
+        batch = []
+        max_workers = min(os.cpu_count() or 1, 16)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            def flush(objects):
+                if use_parts:
+                    # Partial archives skip the symbol table; ranlib indexes
+                    # the final library once they are combined. Their members
+                    # are stored reversed, which the ADDLIB combine undoes.
+                    part = self.tmpdir / f'part{len(parts)}.a'
+                    parts.append(part)
+                    pending.append(executor.submit(archive_objects, part, objects))
+                else:
+                    archive_objects(self.build_lib, objects)
+
+            while True:
+                objects = self._objects.get()
+                if objects is None or self._failed.is_set():
+                    break
+                # Surface a failed partial archive without waiting for the rest
+                for future in pending:
+                    if future.done():
+                        future.result()
+                num_objects += len(objects)
+                batch.extend(objects)
+                while len(batch) >= batch_size:
+                    flush(batch[:batch_size])
+                    batch = batch[batch_size:]
+            if self._failed.is_set():
+                # Extraction failed; drop whatever was not archived yet
+                for future in pending:
+                    future.cancel()
+                return 0
+
+            if batch:
+                flush(batch)
+
+            for future in pending:
+                future.result()
+
+        if not num_objects:
+            self.logger.error("No object files found for merging")
+            raise RuntimeError("No objects to merge")
+
+        # Everything is archived now; free the space before combining
+        self._remove_extracted_objects()
+        if use_parts:
+            self._merge_mri_script(parts)
+            for part in parts:
+                part.unlink()
+        return num_objects
+
+    def _remove_extracted_objects(self):
+        """Delete the per-library extraction directories from tmpdir"""
+        with os.scandir(self.tmpdir) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+
+    def _merge_direct(self, archive, obj_files):
         """Directly pass objects to ar command (macOS)"""
-        cmd = self.ar_cmd + [str(self.output_lib)]
-        cmd += [str(obj) for obj in obj_files]
+        cmd = self.ar_cmd + [str(archive), *obj_files]
         self._run_command(cmd)
 
-    def _merge_with_filelist(self, obj_files):
-        """Use file list for Windows/Linux"""
-
-        obj_files = [str(obj) for obj in obj_files]
-        content = '\n'.join(obj_files)
-        with open('tmpfile.txt', 'w') as f:
-            f.write(content)
+    def _archive_mri_stream(self, archive, obj_files):
+        """Add objects to an archive by piping ADDMOD commands to ar -M
 
+        ar inserts each ADDMOD object at the head of the archive, so the
+        members end up in reverse order.
+        """
+        cmd = [self.ar_bin, '-M']
+        self.logger.info("Executing: %s (%d objects to %s)",
+                         ' '.join(cmd), len(obj_files), archive)
 
-        cmd = self.ar_cmd + [str(self.output_lib), '@tmpfile.txt']
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        try:
+            buf = bytearray(b'CREATE ' + os.fsencode(archive) + b'\n')
+            for obj in obj_files:
+                buf += b'ADDMOD '
+                buf += os.fsencode(obj)
+                buf += b'\n'
+                if len(buf) > 65536:
+                    proc.stdin.write(buf)
+                    buf.clear()
+            buf += b'SAVE\nEND\n'
+            proc.stdin.write(buf)
+        except BrokenPipeError:
+            # ar exited early; its exit status is reported below
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = proc.wait()
+
+        if returncode:
+            self.logger.error("Command failed with exit code %d", returncode)
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+    def _archive_filelist(self, archive, obj_files):
+        """Add objects to an archive through an ar @file list"""
+        # Stream the list in 64 KiB chunks rather than joining it in memory
+        with tempfile.NamedTemporaryFile(mode='wb', dir=self.tmpdir,
+                                         suffix='.txt', delete=False) as f:
+            buf = bytearray()
+            for obj in obj_files:
+                # Quote each path; ar splits @file contents on whitespace
+                buf += b'"'
+                buf += os.fsencode(obj).replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+                buf += b'"\n'
+                if len(buf) > 65536:
+                    f.write(buf)
+                    buf.clear()
+            if buf:
+                f.write(buf)
+
+        cmd = self.ar_cmd + [str(archive), f"@{self._to_win_path(f.name)}"]
         self._run_command(cmd)
 
     def _run_ranlib(self):
         """Execute ranlib if needed"""
         self.logger.info("Running ranlib")
-        self._run_command(['ranlib', str(self.output_lib)])
+        self._run_command([self.ranlib_bin, str(self.build_lib)])
+
+    def _shm_has_space(self, required_bytes):
+        """Check whether /dev/shm can hold required_bytes"""
+        try:
+            stat = os.statvfs('/dev/shm')
+        except OSError:
+            return False
+        return stat.f_bavail * stat.f_frsize >= required_bytes
+
+    def _get_tmp_base(self):
+        """Pick the parent directory for temporary files"""
+        if self.tmp_base is not None:
+            return self.tmp_base
+
+        # Keep extracted objects in RAM when tmpfs is available
+        if self.system != 'Linux' or self._use_mri_script():
+            return None
+        if not os.path.isdir('/dev/shm'):
+            return None
+
+        # Each stage holds roughly two copies of the input at once: extracted
+        # objects and the partial archives built from them, the parts and
+        # the combined library, then the library and ranlib's rewrite of it.
+        # Stages free their inputs as they go; allow three copies for slack.
+        libs = self._collect_llvm_libs()
+        try:
+            libs.append(self._find_std_library())
+        except Exception:
+            pass
+        required_bytes = 3 * sum(lib.stat().st_size for lib in libs if lib is not None)
+        if not self._shm_has_space(required_bytes):
+            self.logger.info("Not enough space in /dev/shm, using default temporary directory")
+            return None
+        return '/dev/shm'
 
     def merge_libraries(self):
         """Main merging workflow"""
-        with tempfile.TemporaryDirectory() as tmpdir:
+        with tempfile.TemporaryDirectory(dir=self._get_tmp_base()) as tmpdir:
             self.tmpdir = Path(tmpdir)
-            self.logger.info(f"Using temporary directory: {self.tmpdir}")
+            self.logger.info("Using temporary directory: %s", self.tmpdir)
 
             try:
-                self.extract_std_objects()
-                self.extract_llvm_objects()
-                self.merge_objects()
+                if self._use_mri_script():
+                    self.merge_archives()
+                else:
+                    self.merge_objects()
             except Exception as e:
-                self.logger.error(f"Merging failed: {e}", exc_info=True)
+                self.logger.error("Merging failed: %s", e, exc_info=True)
                 raise
 
 def configure_logging(verbose=False):
@@ -238,6 +784,15 @@ def main():
                         help='Output library path')
     parser.add_argument('--llvm-install-dir', required=True,
                         help='LLVM installation directory')
+    parser.add_argument('--extract-objects', action='store_true',
+                        help='Extract and re-archive object files instead of '
+                             'merging archives with an ar MRI script')
+    parser.add_argument('--dedupe-objects', action='store_true',
+                        help='Drop byte-identical objects found in several '
+                             'libraries (implies --extract-objects)')
+    parser.add_argument('--tmpdir',
+                        help='Directory for temporary files '
+                             '(default: /dev/shm on Linux when it has room)')
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='Enable verbose output')
     
@@ -245,11 +800,13 @@ def main():
 
     try:
         configure_logging(args.verbose)
-        merger = StaticLibraryMerger(args.output, args.llvm_install_dir)
+        merger = StaticLibraryMerger(args.output, args.llvm_install_dir,
+                                     args.extract_objects, args.tmpdir,
+                                     args.dedupe_objects)
         merger.merge_libraries()
-        logging.info(f"Successfully created library: {args.output}")
+        logging.info("Successfully created library: %s", args.output)
     except Exception as e:
-        logging.error(f"Fatal error: {e}")
+        logging.error("Fatal error: %s", e)
         sys.exit(1)
 
 if __name__ == '__main__':